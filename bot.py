@@ -12,23 +12,42 @@ Features:
 - Deposit (request) via /naptien -> admin approves and bot credits user
 - Withdraw via /ruttien -> admin approves or deny
 - History, leaderboard (top streaks), details
-- Save data to data.json
+- Save data to data.json (periodic snapshot + data.log journal of mutations)
 - Crash detection: if roll not posted in time, notify admins
 - Demo-only: virtual currency only
 """
 
 import os
+import re
+import copy
 import json
 import time
 import threading
 import random
+import heapq
 import traceback
+from io import BytesIO
 from datetime import datetime
-from functools import wraps
+from functools import wraps, lru_cache
+from contextlib import contextmanager
 
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler
 
+# fast JSON for data.json snapshots: orjson, then ujson, then stdlib (all produce compact UTF-8 bytes)
+try:
+    import orjson
+    _dumps = lambda d: orjson.dumps(d, option=orjson.OPT_NON_STR_KEYS)
+    _loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        _dumps = lambda d: ujson.dumps(d, ensure_ascii=False).encode('utf-8')
+        _loads = ujson.loads
+    except ImportError:
+        _dumps = lambda d: json.dumps(d, ensure_ascii=False, separators=(',',':')).encode('utf-8')
+        _loads = json.loads
+
 # ---------------- CONFIG ----------------
 BOT_TOKEN = os.environ.get('BOT_TOKEN', 'PUT_YOUR_TOKEN_HERE')
 ADMINS = []
@@ -41,36 +60,233 @@ if ADMIN_IDS_ENV:
 GROUP_ID = os.environ.get('GROUP_ID')  # optional: limit to one group id (string)
 ROLL_INTERVAL = int(os.environ.get('ROLL_INTERVAL', '60'))  # seconds between auto-rolls
 DATA_FILE = 'data.json'
+JOURNAL_FILE = 'data.log'  # append-only log of mutations since the last snapshot
+HISTORY_ARCHIVE_FILE = 'history_archive.jsonl'  # rounds trimmed from data['history'], one per line
+HISTORY_LIMIT = 500  # rounds kept in data['history'] (and in each user's history)
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', '30'))  # seconds between data.json snapshots
 BET_WINDOW = int(os.environ.get('BET_WINDOW', '50'))  # seconds from bet open until roll (we roll each interval)
 INITIAL_BONUS = 10000  # 10k on first join (but only 1k usable per rules)
 MAX_BONUS_BET = 1000
+# payouts are integer fractions so money math never goes through floats
+PAY_NUM, PAY_DEN = 197, 100  # winners get x1.97 of stake (meaning profit 0.97 * stake)
+POT_CUT_PCT = 30  # % of winners' profit that goes to the pot
+
+# command parsers
+_BET_RE = re.compile(r'^\/([TtXx])\s*([0-9]+)$')
+_NAP_RE = re.compile(r'^\/naptien\s+([0-9]+)$', re.IGNORECASE)
+_RUT_RE = re.compile(r'^\/ruttien\s+([0-9]+)$', re.IGNORECASE)
+_BIAS_RE = re.compile(r'^\/setbias\s+T:([0-9]*\.?[0-9]+)$', re.IGNORECASE)
 
 # ---------------- STORAGE ----------------
-data_lock = threading.Lock()
+class RWLock:
+    # readers share the lock, a writer holds it exclusively; a waiting writer blocks new readers
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+
+    @contextmanager
+    def r_lock(self):
+        with self._cond:
+            while self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def w_lock(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            try:
+                yield
+            finally:
+                self._cond.notify_all()
+
+data_lock = threading.Lock()  # data.json / data.log file I/O
+# per-shard locks; always acquire in this order: round_lock, requests_lock, users_lock, data_lock
+round_lock = RWLock()     # data['round'], data['bets']
+requests_lock = RWLock()  # data['deposit_requests'], data['withdraw_requests']
+users_lock = RWLock()     # data['users'], data['pot'], data['history']
 
 default_data = {
-    'users': {},  # user_id -> {balance:int, first_bonus_given:bool, streak:int, best_streak:int, history:[...]}
-    'bets': {},   # current bets keyed by round_id -> {user_id: {'side':'T'/'X', 'amount':int}}
+    'users': {},  # user_id (int in memory, str in data.json) -> {balance:int, first_bonus_given:bool, streak:int, best_streak:int, history:[...]}
+    'bets': {},   # current bets keyed by round_id (int in memory, str in data.json) -> {user_id: {'side':'T'/'X', 'amount':int}}
     'round': { 'id': 0, 'status': 'idle', 'scheduled_roll_ts': None, 'forced_next': None, 'bias': None },
     'history': [], # list of rounds: {id, timestamp, dice:[a,b,c], total, side, bets, payouts, pot_before, pot_after, distributed_from_pot}
     'pot': 0,      # hu amount
     'withdraw_requests': [], # each: {id, user_id, amount, time, status, admin_id}
-    'deposit_requests': []  # each: {id, user_id, amount, time, status, admin_id}
+    'deposit_requests': [],  # each: {id, user_id, amount, time, status, admin_id}
+    '_rev': 0  # bumped on every mutation; save_data skips the write when it matches the last saved one
 }
 
+def _new_user():
+    return {
+        'balance': 0,
+        'first_bonus_given': False,
+        'streak': 0,
+        'best_streak': 0,
+        'history': []  # list of round ids and results
+    }
+
+def _to_jsonable(d):
+    # JSON object keys must be strings; users/bets are int-keyed in memory
+    out = dict(d)
+    out['users'] = {str(uid): u for uid, u in d['users'].items()}
+    out['bets'] = {str(rid): {str(uid): b for uid, b in bets.items()} for rid, bets in d['bets'].items()}
+    return out
+
+def _from_jsonable(d):
+    d['users'] = {int(uid): u for uid, u in d['users'].items()}
+    d['bets'] = {int(rid): {int(uid): b for uid, b in bets.items()} for rid, bets in d['bets'].items()}
+    return d
+
+def _replay(d, rec):
+    # apply one journal record on top of a snapshot
+    op = rec['op']
+    d['_rev'] = rec['rev']
+    if op in ('add_balance', 'sub_balance'):
+        u = d['users'].setdefault(rec['uid'], _new_user())
+        u['balance'] += rec['amt'] if op == 'add_balance' else -rec['amt']
+    elif op == 'bet':
+        # one record per bet: the stake deduction and the bet itself
+        u = d['users'].setdefault(rec['uid'], _new_user())
+        u['balance'] -= rec['amt']
+        d['bets'].setdefault(rec['rid'], {})[rec['uid']] = {'side': rec['side'], 'amount': rec['amt']}
+    elif op == 'open_round':
+        d['round']['id'] = rec['rid']
+        d['round']['status'] = 'open'
+        d['round']['scheduled_roll_ts'] = rec['ts']
+        d['bets'][rec['rid']] = {}
+
 def load_data():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE,'w') as f:
-            json.dump(default_data,f,indent=2)
-    with open(DATA_FILE,'r') as f:
-        return json.load(f)
+    global _last_saved_rev
+    if os.path.exists(DATA_FILE):
+        with open(DATA_FILE,'rb') as f:
+            d = _from_jsonable(_loads(f.read()))
+    else:
+        d = copy.deepcopy(default_data)
+    _last_saved_rev = d.get('_rev', 0)
+    # replay mutations journaled after the last snapshot; records at or below the
+    # snapshot's rev are already in it (crash between os.replace and truncating the log)
+    if os.path.exists(JOURNAL_FILE):
+        with open(JOURNAL_FILE,'rb+') as f:
+            raw = f.read()
+            end = raw.rfind(b'\n') + 1
+            if end < len(raw):
+                # torn last line after a crash: cut it off so the next append starts on a fresh line
+                f.truncate(end)
+        for line in raw[:end].splitlines():
+            rec = json.loads(line)
+            if rec['rev'] > _last_saved_rev:
+                _replay(d, rec)
+    return d
+
+_tx = threading.local()
+_rev_lock = threading.Lock()
+
+@contextmanager
+def _read_all():
+    # shared hold on every shard, in lock order, for whole-state readers (snapshots, /dumpstate)
+    with round_lock.r_lock(), requests_lock.r_lock(), users_lock.r_lock():
+        yield
+
+@contextmanager
+def _transaction():
+    # defer save_data until the outermost transaction on this thread exits, then save once
+    _tx.depth = getattr(_tx, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _tx.depth -= 1
+    if not _tx.depth:
+        save_data(data)
+
+def _touch():
+    # record that data changed since the last snapshot; returns the new rev
+    with _rev_lock:
+        data['_rev'] = data.get('_rev', 0) + 1
+        return data['_rev']
 
 def save_data(d):
+    # full snapshot; everything journaled so far is now in data.json
+    global _last_saved_rev
+    if getattr(_tx, 'depth', 0):
+        return
+    with _read_all(), data_lock:
+        rev = d.get('_rev', 0)
+        if rev == _last_saved_rev:
+            # nothing changed since the last snapshot
+            return
+        # write to a temp file and atomically swap it in, so a crash never leaves a torn data.json
+        tmp = DATA_FILE + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, _dumps(_to_jsonable(d)))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, DATA_FILE)
+        journal_fp.truncate(0)
+        _last_saved_rev = rev
+
+def journal(rec):
+    # append one mutation record tagged with the rev it produces; caller must hold data_lock
+    rec['rev'] = _touch()
+    journal_fp.write(json.dumps(rec, separators=(',',':')) + '\n')
+    os.fsync(journal_fp.fileno())
+
+def archive_history(recs):
+    # append rounds dropped from data['history'] to the archive file
     with data_lock:
-        with open(DATA_FILE,'w') as f:
-            json.dump(d, f, indent=2, ensure_ascii=False)
+        with open(HISTORY_ARCHIVE_FILE, 'a', encoding='utf-8') as f:
+            for rec in recs:
+                f.write(json.dumps(rec, ensure_ascii=False, separators=(',',':')) + '\n')
+
+def maybe_snapshot(last_snapshot):
+    # write a snapshot if SNAPSHOT_INTERVAL passed since last_snapshot; returns the new timestamp
+    now = time.monotonic()
+    if now - last_snapshot < SNAPSHOT_INTERVAL:
+        return last_snapshot
+    save_data(data)
+    return now
 
 data = load_data()
+journal_fp = open(JOURNAL_FILE, 'a', buffering=1)
+# request id -> request dict (same objects as in the lists), guarded by requests_lock
+_dep_idx = {r['id']: r for r in data['deposit_requests']}
+_wd_idx = {r['id']: r for r in data['withdraw_requests']}
+
+# ---------------- LEADERBOARD INDEX ----------------
+LEADERBOARD_SIZE = 10
+# top users by best_streak as [uid, best_streak], highest first; guarded by users_lock.
+# best_streak never decreases, so updating on increase (plus filling a short list with
+# newly created users, see _ensure_user_locked) keeps this equal to a full sort.
+_top_streaks = [[uid, info.get('best_streak',0)] for uid, info in
+                heapq.nlargest(LEADERBOARD_SIZE, data['users'].items(), key=lambda kv: kv[1].get('best_streak',0))]
+
+def update_top_streaks(uid, best):
+    # call with users_lock held for writing whenever a user's best_streak grows
+    for entry in _top_streaks:
+        if entry[0] == uid:
+            entry[1] = best
+            break
+    else:
+        if len(_top_streaks) >= LEADERBOARD_SIZE and best <= _top_streaks[-1][1]:
+            return
+        _top_streaks.append([uid, best])
+    _top_streaks.sort(key=lambda x: x[1], reverse=True)
+    del _top_streaks[LEADERBOARD_SIZE:]
 
 # ---------------- UTIL ----------------
 def is_admin(user_id):
@@ -86,184 +302,231 @@ def admin_only(func):
         return func(update, context)
     return wrapper
 
+@lru_cache(maxsize=4096)
 def user_display_mask(user_id):
     s = str(user_id)
     if len(s) >= 5:
         return s[:2] + "..." + s[-3:]
     return s
 
+def _ensure_user_locked(uid):
+    # caller holds users_lock for writing
+    rec = data['users'].get(uid)
+    if rec is None:
+        rec = data['users'][uid] = _new_user()
+        _touch()
+        # same rule as the startup seed: a short leaderboard lists zero-streak users too
+        if len(_top_streaks) < LEADERBOARD_SIZE:
+            _top_streaks.append([uid, 0])
+    return rec
+
 def ensure_user(u):
-    uid = str(u)
-    if uid not in data['users']:
-        data['users'][uid] = {
-            'balance': 0,
-            'first_bonus_given': False,
-            'streak': 0,
-            'best_streak': 0,
-            'history': []  # list of round ids and results
-        }
+    uid = int(u)
+    rec = data['users'].get(uid)
+    if rec is None:
+        with users_lock.w_lock():
+            rec = _ensure_user_locked(uid)
+    return rec
 
 def give_first_bonus_if_needed(user_id):
-    uid = str(user_id)
-    ensure_user(user_id)
-    if not data['users'][uid]['first_bonus_given']:
-        data['users'][uid]['balance'] += INITIAL_BONUS
-        data['users'][uid]['first_bonus_given'] = True
-        # Note: restrict betting from bonus separately when checking bet acceptance
-        save_data(data)
-        return True
-    return False
+    u = ensure_user(user_id)
+    with users_lock.w_lock():
+        if u['first_bonus_given']:
+            return False
+        u['balance'] += INITIAL_BONUS
+        u['first_bonus_given'] = True
+        _touch()
+    # Note: restrict betting from bonus separately when checking bet acceptance
+    save_data(data)
+    return True
 
 def add_balance(user_id, amount):
-    ensure_user(user_id)
-    data['users'][str(user_id)]['balance'] += int(amount)
-    save_data(data)
+    u = ensure_user(user_id)
+    with users_lock.w_lock(), data_lock:
+        u['balance'] += int(amount)
+        journal({'op': 'add_balance', 'uid': int(user_id), 'amt': int(amount)})
+
+def _add_balance_nosave(user_id, amount):
+    # in-memory credit only; caller holds users_lock and persists with save_data
+    _ensure_user_locked(int(user_id))['balance'] += int(amount)
+    _touch()
 
 def sub_balance(user_id, amount):
-    ensure_user(user_id)
-    data['users'][str(user_id)]['balance'] -= int(amount)
-    save_data(data)
+    u = ensure_user(user_id)
+    with users_lock.w_lock(), data_lock:
+        u['balance'] -= int(amount)
+        journal({'op': 'sub_balance', 'uid': int(user_id), 'amt': int(amount)})
 
 def get_balance(user_id):
-    ensure_user(user_id)
-    return int(data['users'][str(user_id)]['balance'])
+    u = ensure_user(user_id)
+    with users_lock.r_lock():
+        return int(u['balance'])
 
 def record_user_history(user_id, rec):
-    ensure_user(user_id)
-    data['users'][str(user_id)]['history'].append(rec)
+    u = ensure_user(user_id)
+    with users_lock.w_lock():
+        h = u['history']
+        h.append(rec)
+        if len(h) > HISTORY_LIMIT:
+            del h[:-HISTORY_LIMIT]
+        _touch()
     save_data(data)
 
 # ---------------- BET / ROUND LOGIC ----------------
 def open_new_round():
-    # increment round id
-    data['round']['id'] = data['round'].get('id', 0) + 1
-    rid = data['round']['id']
-    data['round']['status'] = 'open'
-    # schedule next roll ts
-    data['round']['scheduled_roll_ts'] = int(time.time()) + ROLL_INTERVAL
-    data['bets'][str(rid)] = {}
-    save_data(data)
+    with round_lock.w_lock(), data_lock:
+        # increment round id
+        data['round']['id'] = data['round'].get('id', 0) + 1
+        rid = data['round']['id']
+        data['round']['status'] = 'open'
+        # schedule next roll ts
+        data['round']['scheduled_roll_ts'] = int(time.time()) + ROLL_INTERVAL
+        data['bets'][rid] = {}
+        journal({'op': 'open_round', 'rid': rid, 'ts': data['round']['scheduled_roll_ts']})
     return rid
 
+# monotonic time of the last roll settled by this process (None until the first one)
+_last_roll_mono = None
+
+def _mark_roll():
+    global _last_roll_mono
+    _last_roll_mono = time.monotonic()
+
+@_transaction()
 def close_betting_and_roll(bot: Bot, chat_id):
     # close current betting, perform roll (taking into account forced_next / bias)
-    rid = data['round']['id']
-    if data['round']['status'] != 'open':
-        return None
-    data['round']['status'] = 'closed'
-    save_data(data)
-    # compute result
-    # admin forced?
-    forced = data['round'].get('forced_next')
-    dice = None
-    if forced in ('T','X'):
-        # generate dice that fit forced side
-        dice = generate_dice_for_side(forced)
-    else:
-        # bias handling: if bias set as dict {'T':p, 'X':q}
-        bias = data['round'].get('bias')
-        if bias and isinstance(bias, dict):
-            pT = bias.get('T', 0.5)
-            # sample side with pT
-            side = 'T' if random.random() < pT else 'X'
-            dice = generate_dice_for_side(side)
-        else:
-            # random normal roll
-            dice = [random.randint(1,6) for _ in range(3)]
-    total = sum(dice)
-    side = 'T' if 11 <= total <= 17 else 'X'
-    # settle bets
-    pot_before = data['pot']
-    bets_for_round = data['bets'].get(str(rid), {})
-    # compute totals
-    total_bets_T = sum(bets_for_round.get(uid, {}).get('amount',0) for uid in bets_for_round if bets_for_round[uid]['side']=='T')
-    total_bets_X = sum(bets_for_round.get(uid, {}).get('amount',0) for uid in bets_for_round if bets_for_round[uid]['side']=='X')
-    winners = [int(uid) for uid in bets_for_round if bets_for_round[uid]['side']==side]
-    losers = [int(uid) for uid in bets_for_round if bets_for_round[uid]['side']!=side]
-    payouts = {}
-    # payout multiplier: winners get x1.97 of stake (meaning profit 0.97 * stake)
-    PAY_MULTI = 1.97
-    # collect pot contributions: winners' payout contribute 30% of winners' payout profit, losers' stakes go to pot
-    winners_total_stake = sum(bets_for_round[uid]['amount'] for uid in bets_for_round if bets_for_round[uid]['side']==side)
-    losers_total_stake = sum(bets_for_round[uid]['amount'] for uid in bets_for_round if bets_for_round[uid]['side']!=side)
-    # basic payouts: pay each winner stake * PAY_MULTI (rounded)
-    for uid_str, bet in bets_for_round.items():
-        uid = int(uid_str)
-        amt = int(bet['amount'])
-        if bet['side']==side:
-            pay = int(round(amt * PAY_MULTI))
-            payouts[uid] = pay
-        else:
-            payouts[uid] = 0
-    # pot adjustments:
-    # - add all losers' stakes to pot
-    data['pot'] += losers_total_stake
-    # - take 30% of winners' payout profits (profit = payout - stake) into pot
-    winners_profit = sum(int(round(bets_for_round[uid]['amount']* (PAY_MULTI-1))) for uid in bets_for_round if bets_for_round[uid]['side']==side)
-    winners_profit_cut = int(round(winners_profit * 0.30))
-    data['pot'] += winners_profit_cut
-    # now actually credit payouts to winners and debit stakes already reserved
-    # NOTE: We didn't reserve stakes; we will deduct stakes at bet time. So here we only credit payouts (net)
-    # For fair accounting: at bet time we already subtracted stake; here add payout to winners.
-    for uid, pay in payouts.items():
-        if pay>0:
-            add_balance(uid, pay)
-            # update streak
-            ensure_user(uid)
-            data['users'][str(uid)]['streak'] = data['users'][str(uid)].get('streak',0) + 1
-            data['users'][str(uid)]['best_streak'] = max(data['users'][str(uid)].get('best_streak',0), data['users'][str(uid)]['streak'])
+    # round_lock is held for the whole settlement so a snapshot never sees a half-settled round
+    with round_lock.w_lock():
+        rid = data['round']['id']
+        if data['round']['status'] != 'open':
+            return None
+        # no bet can be recorded after this point
+        data['round']['status'] = 'closed'
+        _touch()
+        # compute result
+        # admin forced?
+        forced = data['round'].get('forced_next')
+        dice = None
+        if forced in ('T','X'):
+            # generate dice that fit forced side
+            dice = generate_dice_for_side(forced)
         else:
-            # loser -> reset streak
-            ensure_user(uid)
-            data['users'][str(uid)]['streak'] = 0
-    # check triple 1 or triple 6 for special pot distribution
-    distributed_from_pot = 0
-    if dice.count(1) == 3 or dice.count(6) == 3:
-        # distribute full pot among winners (if any) proportionally to their stake
-        if winners:
-            pot_amount = data['pot']
-            distributed_from_pot = pot_amount
-            # compute winner stakes to split proportionally
-            total_winner_stakes = sum(bets_for_round[str(uid)]['amount'] for uid in winners)
-            for uid in winners:
-                stake = bets_for_round[str(uid)]['amount']
-                share = int(round(pot_amount * (stake / total_winner_stakes))) if total_winner_stakes>0 else int(pot_amount/len(winners))
-                add_balance(uid, share)
-            data['pot'] = 0
-    # record history entry
-    hist_rec = {
-        'id': rid,
-        'timestamp': int(time.time()),
-        'dice': dice,
-        'total': total,
-        'side': side,
-        'bets': { uid: data['bets'][str(rid)][uid] for uid in data['bets'][str(rid)] },
-        'payouts': payouts,
-        'pot_before': pot_before,
-        'pot_after': data['pot'],
-        'distributed_from_pot': distributed_from_pot
-    }
-    data['history'].append(hist_rec)
-    # cleanup
-    data['bets'].pop(str(rid), None)
-    data['round']['status'] = 'idle'
-    data['round']['forced_next'] = None
-    save_data(data)
+            # bias handling: if bias set as dict {'T':p, 'X':q}
+            bias = data['round'].get('bias')
+            if bias and isinstance(bias, dict):
+                pT = bias.get('T', 0.5)
+                # sample side with pT
+                side = 'T' if random.random() < pT else 'X'
+                dice = generate_dice_for_side(side)
+            else:
+                # random normal roll
+                dice = random.choices(_DICE, k=3)
+        total = sum(dice)
+        side = 'T' if 11 <= total <= 17 else 'X'
+        # settle bets
+        with users_lock.w_lock():
+            pot_before = data['pot']
+            bets_for_round = data['bets'].get(rid, {})
+            payouts = {}
+            # single pass over the bets: side totals, winners/losers and basic payouts (stake * PAY_NUM/PAY_DEN, floored)
+            total_bets_T = total_bets_X = 0
+            winners, losers = [], []
+            winners_total_stake = losers_total_stake = 0
+            winners_profit = 0
+            for uid, bet in bets_for_round.items():
+                amt = int(bet['amount'])
+                bet_side = bet['side']
+                if bet_side == 'T':
+                    total_bets_T += amt
+                else:
+                    total_bets_X += amt
+                if bet_side == side:
+                    winners.append(uid)
+                    winners_total_stake += amt
+                    winners_profit += amt * (PAY_NUM - PAY_DEN) // PAY_DEN
+                    payouts[uid] = amt * PAY_NUM // PAY_DEN
+                else:
+                    losers.append(uid)
+                    losers_total_stake += amt
+                    payouts[uid] = 0
+            # pot adjustments (winners contribute 30% of their payout profit, losers' stakes go to pot):
+            # - add all losers' stakes to pot
+            data['pot'] += losers_total_stake
+            # - take 30% of winners' payout profits (profit = payout - stake) into pot
+            winners_profit_cut = winners_profit * POT_CUT_PCT // 100
+            data['pot'] += winners_profit_cut
+            # now actually credit payouts to winners and debit stakes already reserved
+            # NOTE: We didn't reserve stakes; we will deduct stakes at bet time. So here we only credit payouts (net)
+            # For fair accounting: at bet time we already subtracted stake; here add payout to winners.
+            for uid, pay in payouts.items():
+                u = _ensure_user_locked(uid)
+                if pay>0:
+                    u['balance'] += pay
+                    # update streak
+                    u['streak'] = u.get('streak',0) + 1
+                    if u['streak'] > u.get('best_streak',0):
+                        u['best_streak'] = u['streak']
+                        update_top_streaks(uid, u['best_streak'])
+                else:
+                    # loser -> reset streak
+                    u['streak'] = 0
+            # check triple 1 or triple 6 for special pot distribution
+            distributed_from_pot = 0
+            if dice.count(1) == 3 or dice.count(6) == 3:
+                # distribute full pot among winners (if any) proportionally to their stake
+                if winners:
+                    pot_amount = data['pot']
+                    # compute winner stakes to split proportionally
+                    total_winner_stakes = winners_total_stake
+                    for uid in winners:
+                        stake = bets_for_round[uid]['amount']
+                        share = pot_amount * stake // total_winner_stakes if total_winner_stakes>0 else pot_amount // len(winners)
+                        _add_balance_nosave(uid, share)
+                        distributed_from_pot += share
+                    # flooring leaves at most a few units behind; they stay in the pot
+                    data['pot'] = pot_amount - distributed_from_pot
+            # record history entry
+            hist_rec = {
+                'id': rid,
+                'timestamp': int(time.time()),
+                'dice': dice,
+                'total': total,
+                'side': side,
+                'bets': dict(bets_for_round),
+                'payouts': payouts,
+                'pot_before': pot_before,
+                'pot_after': data['pot'],
+                'distributed_from_pot': distributed_from_pot
+            }
+            data['history'].append(hist_rec)
+            _mark_roll()
+            # keep data.json bounded: spill the oldest rounds to the archive
+            if len(data['history']) > HISTORY_LIMIT:
+                archive_history(data['history'][:-HISTORY_LIMIT])
+                del data['history'][:-HISTORY_LIMIT]
+        # cleanup
+        data['bets'].pop(rid, None)
+        data['round']['status'] = 'idle'
+        data['round']['forced_next'] = None
+        _touch()
     # compose message
     text = f"🎲 Phiên #{rid} — Kết quả:\n"
     # animation will be handled outside (we return dice and text)
     return hist_rec
 
+_DICE = (1, 2, 3, 4, 5, 6)
+
+# all 216 ordered dice triples grouped by side; choosing uniformly from a group
+# samples exactly the conditional distribution of a fair roll given that side
+_SIDE_TRIPLES = {'T': [], 'X': []}
+for _d1 in _DICE:
+    for _d2 in _DICE:
+        for _d3 in _DICE:
+            _SIDE_TRIPLES['T' if 11 <= _d1+_d2+_d3 <= 17 else 'X'].append((_d1, _d2, _d3))
+
 def generate_dice_for_side(side):
-    # generate dice triple so that total falls into desired side (heuristic trying random until match)
-    for _ in range(200):
-        d = [random.randint(1,6) for _ in range(3)]
-        tot = sum(d)
-        s = 'T' if 11 <= tot <= 17 else 'X'
-        if s == side:
-            return d
-    # fallback: random
-    return [random.randint(1,6) for _ in range(3)]
+    # generate dice triple so that total falls into desired side
+    return list(random.choice(_SIDE_TRIPLES[side]))
 
 # ---------------- BOT HANDLERS ----------------
 updater = Updater(BOT_TOKEN, use_context=True)
@@ -300,50 +563,62 @@ def start_cmd(update: Update, context: CallbackContext):
 
 def balance_cmd(update: Update, context: CallbackContext):
     uid = update.effective_user.id
-    ensure_user(uid)
     bal = get_balance(uid)
     update.message.reply_text(f"Số dư của bạn: {bal} VNĐ")
 
 # betting command parser: e.g. /T1000 or /X500
-@run_in_group_only
 def handle_bet_command(update: Update, context: CallbackContext):
+    # receives every group text message: cheap prefix test, then the full pattern,
+    # so only real bets reach the group check (other /t.., /x.. commands get no reply)
+    text = update.message.text
+    if len(text) < 3 or text[0] != '/' or text[1] not in 'TtXx':
+        return
+    if not _BET_RE.match(text.strip()):
+        return
+    return _place_bet(update, context)
+
+@run_in_group_only
+def _place_bet(update: Update, context: CallbackContext):
     text = update.message.text.strip()
     user = update.effective_user
     # parse patterns: /T1000 , /t1000 , /X500
-    import re
-    m = re.match(r'^\/([TtXx])\s*([0-9]+)$', text)
+    m = _BET_RE.match(text)
     if not m:
         # also accept without slash if people type just T1000? we require slash
         return
     side = m.group(1).upper()
     amt = int(m.group(2))
     uid = user.id
-    # only accept if current round open
-    rid = data['round'].get('id', 0)
-    if data['round'].get('status') != 'open':
-        update.message.reply_text("Hiện không mở cửa cược. Xin chờ phiên mới.")
-        return
-    # check balance
-    ensure_user(uid)
-    bal = get_balance(uid)
-    # enforce bonus staking limit: if user has just bonus and balance equals INITIAL_BONUS and first time, limit bet to MAX_BONUS_BET
-    if data['users'][str(uid)]['first_bonus_given'] and bal == INITIAL_BONUS:
-        if amt > MAX_BONUS_BET:
-            update.message.reply_text(f"Bạn chỉ được cược tối đa {MAX_BONUS_BET} VNĐ sử dụng tiền thưởng ban đầu.")
-            return
-    if amt <= 0:
-        update.message.reply_text("Số tiền không hợp lệ.")
-        return
-    if amt > bal:
-        update.message.reply_text("Số tiền không đủ.")
+    # only accept if current round open; bettors share round_lock, closing the round takes it exclusively
+    err = None
+    with round_lock.r_lock():
+        rid = data['round'].get('id', 0)
+        if data['round'].get('status') != 'open':
+            err = "Hiện không mở cửa cược. Xin chờ phiên mới."
+        else:
+            user_rec = ensure_user(uid)
+            # check balance and deduct stake under one users_lock hold
+            with users_lock.w_lock():
+                bal = int(user_rec['balance'])
+                # enforce bonus staking limit: if user has just bonus and balance equals INITIAL_BONUS and first time, limit bet to MAX_BONUS_BET
+                if user_rec['first_bonus_given'] and bal == INITIAL_BONUS and amt > MAX_BONUS_BET:
+                    err = f"Bạn chỉ được cược tối đa {MAX_BONUS_BET} VNĐ sử dụng tiền thưởng ban đầu."
+                elif amt <= 0:
+                    err = "Số tiền không hợp lệ."
+                elif amt > bal:
+                    err = "Số tiền không đủ."
+                else:
+                    bet_side = 'T' if side=='T' else 'X'
+                    with data_lock:
+                        # deduct stake immediately and record bet; one journal record covers both
+                        user_rec['balance'] -= amt
+                        data['bets'].setdefault(rid, {})[uid] = {'side': bet_side, 'amount': amt}
+                        journal({'op': 'bet', 'rid': rid, 'uid': uid, 'side': bet_side, 'amt': amt})
+                    new_bal = user_rec['balance']
+    if err:
+        update.message.reply_text(err)
         return
-    # deduct stake immediately
-    sub_balance(uid, amt)
-    # record bet
-    bids = data['bets'].setdefault(str(rid), {})
-    bids[str(uid)] = {'side': 'T' if side=='T' else 'X', 'amount': amt}
-    save_data(data)
-    update.message.reply_text(f"Đã nhận cược {amt} VNĐ cho {'Tài' if side=='T' else 'Xỉu'} (Phiên #{rid}). Số dư mới: {get_balance(uid)} VNĐ")
+    update.message.reply_text(f"Đã nhận cược {amt} VNĐ cho {'Tài' if side=='T' else 'Xỉu'} (Phiên #{rid}). Số dư mới: {new_bal} VNĐ")
 
 @run_in_group_only
 def open_bet_cmd(update: Update, context: CallbackContext):
@@ -360,7 +635,8 @@ def open_bet_cmd(update: Update, context: CallbackContext):
 def show_history_cmd(update: Update, context: CallbackContext):
     # show last N rounds summary
     N = 10
-    h = data.get('history', [])[-N:]
+    with users_lock.r_lock():
+        h = data.get('history', [])[-N:]
     if not h:
         update.message.reply_text("Chưa có lịch sử.")
         return
@@ -371,12 +647,15 @@ def show_history_cmd(update: Update, context: CallbackContext):
         txts.append(f"#{rec['id']} {dice[0]}+{dice[1]}+{dice[2]}={rec['total']} → {'Tài' if side=='T' else 'Xỉu'} (pot {rec['pot_before']}→{rec['pot_after']})")
     update.message.reply_text("\n".join(txts))
 
+def _request_kb(kind, rid):
+    # Approve/Deny keyboard for a deposit/withdraw request; built once and shared by every admin notification
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Approve", callback_data=f"approve_{kind}:{rid}"), InlineKeyboardButton("Deny", callback_data=f"deny_{kind}:{rid}")]])
+
 # deposit request
 @run_in_group_only
 def deposit_cmd(update: Update, context: CallbackContext):
     text = update.message.text.strip()
-    import re
-    m = re.match(r'^\/naptien\s+([0-9]+)$', text, re.IGNORECASE)
+    m = _NAP_RE.match(text)
     if not m:
         update.message.reply_text("Dùng: /naptien <số tiền>. (Admin sẽ xác thực và credit thủ công trong demo).")
         return
@@ -384,13 +663,17 @@ def deposit_cmd(update: Update, context: CallbackContext):
     uid = update.effective_user.id
     rid = int(time.time()*1000)
     req = {'id': rid, 'user_id': uid, 'amount': amt, 'time': int(time.time()), 'status': 'pending', 'admin_id': None}
-    data['deposit_requests'].append(req)
+    with requests_lock.w_lock():
+        data['deposit_requests'].append(req)
+        _dep_idx[rid] = req
+        _touch()
     save_data(data)
     # notify admins with inline buttons
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("Approve", callback_data=f"approve_deposit:{rid}"), InlineKeyboardButton("Deny", callback_data=f"deny_deposit:{rid}")]])
+    kb = _request_kb('deposit', rid)
+    msg = f"📥 Deposit request #{rid} từ {user_display_mask(uid)}: {amt} VNĐ"
     for a in ADMINS:
         try:
-            bot.send_message(chat_id=a, text=f"📥 Deposit request #{rid} từ {user_display_mask(uid)}: {amt} VNĐ", reply_markup=kb)
+            bot.send_message(chat_id=a, text=msg, reply_markup=kb)
         except Exception:
             pass
     update.message.reply_text("Đã gửi yêu cầu nạp tiền tới admin. Chờ phê duyệt.")
@@ -399,8 +682,7 @@ def deposit_cmd(update: Update, context: CallbackContext):
 @run_in_group_only
 def withdraw_cmd(update: Update, context: CallbackContext):
     text = update.message.text.strip()
-    import re
-    m = re.match(r'^\/ruttien\s+([0-9]+)$', text, re.IGNORECASE)
+    m = _RUT_RE.match(text)
     if not m:
         update.message.reply_text("Dùng: /ruttien <số tiền>. Lưu ý rút tối thiểu 100000 VNĐ và bạn phải đã cược ít nhất 1 vòng tương ứng số tiền nạp (rule demo).")
         return
@@ -415,12 +697,16 @@ def withdraw_cmd(update: Update, context: CallbackContext):
         return
     rid = int(time.time()*1000)
     req = {'id': rid, 'user_id': uid, 'amount': amt, 'time': int(time.time()), 'status': 'pending', 'admin_id': None}
-    data['withdraw_requests'].append(req)
+    with requests_lock.w_lock():
+        data['withdraw_requests'].append(req)
+        _wd_idx[rid] = req
+        _touch()
     save_data(data)
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("Approve", callback_data=f"approve_withdraw:{rid}"), InlineKeyboardButton("Deny", callback_data=f"deny_withdraw:{rid}")]])
+    kb = _request_kb('withdraw', rid)
+    msg = f"📤 Withdraw request #{rid} từ {user_display_mask(uid)}: {amt} VNĐ"
     for a in ADMINS:
         try:
-            bot.send_message(chat_id=a, text=f"📤 Withdraw request #{rid} từ {user_display_mask(uid)}: {amt} VNĐ", reply_markup=kb)
+            bot.send_message(chat_id=a, text=msg, reply_markup=kb)
         except Exception:
             pass
     update.message.reply_text("Yêu cầu rút tiền đã gửi. Chờ admin xử lý.")
@@ -435,47 +721,59 @@ def callback_query_handler(update: Update, context: CallbackContext):
         return
     if data_str.startswith('approve_deposit:') or data_str.startswith('deny_deposit:'):
         rid = int(data_str.split(':',1)[1])
-        for r in data['deposit_requests']:
-            if r['id']==rid:
-                if data_str.startswith('approve_deposit:'):
-                    r['status']='approved'
-                    r['admin_id']=user.id
+        with requests_lock.r_lock():
+            r = _dep_idx.get(rid)
+        if r is not None:
+            if data_str.startswith('approve_deposit:'):
+                with _transaction():
+                    with requests_lock.w_lock():
+                        r['status']='approved'
+                        r['admin_id']=user.id
+                        _touch()
                     add_balance(r['user_id'], r['amount'])
-                    save_data(data)
-                    query.answer("Đã approve deposit")
-                    # notify group briefly masked
-                    masked = user_display_mask(r['user_id'])
-                    try:
-                        bot.send_message(chat_id=GROUP_ID or update.effective_chat.id, text=f"📥 {masked} đã nạp {r['amount']} VNĐ (đã xác thực bởi admin).")
-                    except:
-                        pass
-                else:
-                    r['status']='denied'; r['admin_id']=user.id; save_data(data)
-                    query.answer("Đã từ chối deposit")
-                return
+                query.answer("Đã approve deposit")
+                # notify group briefly masked
+                masked = user_display_mask(r['user_id'])
+                try:
+                    bot.send_message(chat_id=GROUP_ID or update.effective_chat.id, text=f"📥 {masked} đã nạp {r['amount']} VNĐ (đã xác thực bởi admin).")
+                except:
+                    pass
+            else:
+                with _transaction(), requests_lock.w_lock():
+                    r['status']='denied'; r['admin_id']=user.id
+                    _touch()
+                query.answer("Đã từ chối deposit")
+            return
     if data_str.startswith('approve_withdraw:') or data_str.startswith('deny_withdraw:'):
         rid = int(data_str.split(':',1)[1])
-        for r in data['withdraw_requests']:
-            if r['id']==rid:
-                if data_str.startswith('approve_withdraw:'):
-                    r['status']='approved'; r['admin_id']=user.id
+        with requests_lock.r_lock():
+            r = _wd_idx.get(rid)
+        if r is not None:
+            if data_str.startswith('approve_withdraw:'):
+                with _transaction():
+                    with requests_lock.w_lock():
+                        r['status']='approved'; r['admin_id']=user.id
+                        _touch()
                     # debit user's balance and notify
                     sub_balance(r['user_id'], r['amount'])
-                    save_data(data)
-                    query.answer("Đã approve withdraw")
-                    masked = user_display_mask(r['user_id'])
-                    try:
-                        bot.send_message(chat_id=GROUP_ID or update.effective_chat.id, text=f"📤 {masked} rút {r['amount']} VNĐ (đã duyệt).")
-                    except:
-                        pass
-                else:
-                    r['status']='denied'; r['admin_id']=user.id; save_data(data)
-                    query.answer("Đã từ chối rút tiền")
-                return
+                query.answer("Đã approve withdraw")
+                masked = user_display_mask(r['user_id'])
+                try:
+                    bot.send_message(chat_id=GROUP_ID or update.effective_chat.id, text=f"📤 {masked} rút {r['amount']} VNĐ (đã duyệt).")
+                except:
+                    pass
+            else:
+                with _transaction(), requests_lock.w_lock():
+                    r['status']='denied'; r['admin_id']=user.id
+                    _touch()
+                query.answer("Đã từ chối rút tiền")
+            return
     # admin set next forced
     if data_str.startswith('force_next:'):
         val = data_str.split(':',1)[1]
-        data['round']['forced_next'] = val  # 'T' or 'X'
+        with round_lock.w_lock():
+            data['round']['forced_next'] = val  # 'T' or 'X'
+            _touch()
         save_data(data)
         query.answer(f"Đã set forced next -> {val}")
         return
@@ -484,11 +782,8 @@ def callback_query_handler(update: Update, context: CallbackContext):
 # leaderboard
 def leaderboard_cmd(update: Update, context: CallbackContext):
     # top 10 by best_streak or balance — let's show best_streak
-    users = []
-    for uid, info in data['users'].items():
-        users.append((int(uid), info.get('best_streak',0), info.get('balance',0)))
-    users.sort(key=lambda x: x[1], reverse=True)
-    top = users[:10]
+    with users_lock.r_lock():
+        top = [(uid, streak, data['users'][uid].get('balance',0)) for uid, streak in _top_streaks]
     lines = []
     for uid, streak, bal in top:
         lines.append(f"{user_display_mask(uid)} — best streak: {streak}, bal: {bal}")
@@ -503,10 +798,9 @@ def admin_setnext(update: Update, context: CallbackContext):
         update.message.reply_text("Dùng: /setnext T|X|NONE")
         return
     val = parts[1].upper()
-    if val == 'NONE':
-        data['round']['forced_next'] = None
-    else:
-        data['round']['forced_next'] = val
+    with round_lock.w_lock():
+        data['round']['forced_next'] = None if val == 'NONE' else val
+        _touch()
     save_data(data)
     update.message.reply_text(f"Đã set forced next = {data['round']['forced_next']}")
 
@@ -514,8 +808,7 @@ def admin_setnext(update: Update, context: CallbackContext):
 def admin_setbias(update: Update, context: CallbackContext):
     text = update.message.text.strip()
     # format: /setbias T:0.6 (means P(T)=0.6)
-    import re
-    m = re.match(r'^\/setbias\s+T:([0-9]*\.?[0-9]+)$', text, re.IGNORECASE)
+    m = _BIAS_RE.match(text)
     if not m:
         update.message.reply_text("Dùng: /setbias T:0.6  (value between 0 and 1)")
         return
@@ -523,13 +816,17 @@ def admin_setbias(update: Update, context: CallbackContext):
     if v<0 or v>1:
         update.message.reply_text("Value invalid")
         return
-    data['round']['bias'] = {'T': v, 'X': 1-v}
+    with round_lock.w_lock():
+        data['round']['bias'] = {'T': v, 'X': 1-v}
+        _touch()
     save_data(data)
     update.message.reply_text(f"Đã set bias T={v}, X={1-v}")
 
 # command to show pot
 def pot_cmd(update: Update, context: CallbackContext):
-    update.message.reply_text(f"Hũ hiện tại: {data.get('pot',0)} VNĐ")
+    with users_lock.r_lock():
+        pot = data.get('pot',0)
+    update.message.reply_text(f"Hũ hiện tại: {pot} VNĐ")
 
 # quick admin adjust user balance
 @admin_only
@@ -544,6 +841,18 @@ def admin_credit(update: Update, context: CallbackContext):
     add_balance(uid, amt)
     update.message.reply_text(f"Đã cộng {amt} cho {uid}")
 
+# admin: pretty-printed state for debugging (data.json itself is compact)
+@admin_only
+def admin_dumpstate(update: Update, context: CallbackContext):
+    with _read_all():
+        dump = json.dumps(_to_jsonable(data), indent=2, ensure_ascii=False)
+    buf = BytesIO(dump.encode('utf-8'))
+    buf.name = 'state.json'
+    # always deliver privately: the state holds every user's balance and requests
+    bot.send_document(chat_id=update.effective_user.id, document=buf, filename='state.json')
+    if update.effective_chat.type != 'private':
+        update.message.reply_text("Đã gửi state qua tin nhắn riêng.")
+
 # ---------------- SCHEDULER / AUTO RUN ----------------
 # We'll run a background thread that:
 # - opens round if idle
@@ -553,11 +862,32 @@ def admin_credit(update: Update, context: CallbackContext):
 
 stop_event = threading.Event()
 
+ANIMATION_STEP = 0.9  # seconds between dice reveal edits
+
+def _animation_frame_job(context: CallbackContext):
+    # JobQueue callback: apply the next frame of the roll animation, then schedule the one after it,
+    # so frames stay in order even when an edit is slow
+    chat_id, message_id, frames, fallback = context.job.context
+    try:
+        bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=frames[0])
+    except Exception as e:
+        print("Error posting roll animation:", e)
+        # fallback simple post
+        try:
+            bot.send_message(chat_id=chat_id, text=fallback)
+        except:
+            pass
+        return
+    if len(frames) > 1:
+        context.job_queue.run_once(_animation_frame_job, ANIMATION_STEP,
+                                   context=(chat_id, message_id, frames[1:], fallback))
+
 def post_roll_with_animation(chat_id, hist_rec):
     rid = hist_rec['id']
     dice = hist_rec['dice']
     total = hist_rec['total']
     side = hist_rec['side']
+    fallback = f"🎲 Phiên #{rid}: {dice[0]}+{dice[1]}+{dice[2]} = {total} → {'Tài' if side=='T' else 'Xỉu'}"
     # create animation: send initial message then edit showing dice one by one
     try:
         m = bot.send_message(chat_id=chat_id, text=f"🎲 Phiên #{rid} đang mở kết quả...")
@@ -568,28 +898,27 @@ def post_roll_with_animation(chat_id, hist_rec):
         # show placeholders then fill
         text += " _ _ _ \n"
         bot.edit_message_text(chat_id=chat_id, message_id=m.message_id, text=text)
-        time.sleep(0.9)
-        # fill first
-        text = f"🎲 Phiên #{rid}\nKết quả: {emojis[dice[0]]} _ _ \n"
-        bot.edit_message_text(chat_id=chat_id, message_id=m.message_id, text=text)
-        time.sleep(0.9)
-        text = f"🎲 Phiên #{rid}\nKết quả: {emojis[dice[0]]} {emojis[dice[1]]} _ \n"
-        bot.edit_message_text(chat_id=chat_id, message_id=m.message_id, text=text)
-        time.sleep(0.9)
-        text = f"🎲 Phiên #{rid}\nKết quả: {emojis[dice[0]]} {emojis[dice[1]]} {emojis[dice[2]]} = {total}\n→ {'Tài' if side=='T' else 'Xỉu'}"
-        # include pot info
-        text += f"\nHũ: {hist_rec['pot_before']} → {hist_rec['pot_after']}"
-        bot.edit_message_text(chat_id=chat_id, message_id=m.message_id, text=text)
+        frames = [
+            f"🎲 Phiên #{rid}\nKết quả: {emojis[dice[0]]} _ _ \n",
+            f"🎲 Phiên #{rid}\nKết quả: {emojis[dice[0]]} {emojis[dice[1]]} _ \n",
+            # include pot info
+            f"🎲 Phiên #{rid}\nKết quả: {emojis[dice[0]]} {emojis[dice[1]]} {emojis[dice[2]]} = {total}\n→ {'Tài' if side=='T' else 'Xỉu'}"
+            f"\nHũ: {hist_rec['pot_before']} → {hist_rec['pot_after']}",
+        ]
+        # remaining edits run on the JobQueue (one chained job per frame) so the scheduler thread doesn't sleep through them
+        updater.job_queue.run_once(_animation_frame_job, ANIMATION_STEP,
+                                   context=(chat_id, m.message_id, frames, fallback))
     except Exception as e:
         print("Error posting roll animation:", e)
         # fallback simple post
         try:
-            bot.send_message(chat_id=chat_id, text=f"🎲 Phiên #{rid}: {dice[0]}+{dice[1]}+{dice[2]} = {total} → {'Tài' if side=='T' else 'Xỉu'}")
+            bot.send_message(chat_id=chat_id, text=fallback)
         except:
             pass
 
 def scheduler_loop(chat_id):
     # run until stopped
+    last_snapshot = time.monotonic()
     try:
         while not stop_event.is_set():
             try:
@@ -604,16 +933,21 @@ def scheduler_loop(chat_id):
                 # wait until scheduled roll ts or until stop
                 now = int(time.time())
                 sched = data['round'].get('scheduled_roll_ts') or (now + ROLL_INTERVAL)
-                # sleep until scheduled time (but wake up occasionally to detect stop)
-                while int(time.time()) < sched and not stop_event.is_set():
-                    time.sleep(1)
+                # block until scheduled time or stop; wake up only to take periodic snapshots
+                while True:
+                    remaining = sched - time.time()
+                    if remaining <= 0 or stop_event.wait(timeout=min(remaining, SNAPSHOT_INTERVAL)):
+                        break
+                    last_snapshot = maybe_snapshot(last_snapshot)
+                if stop_event.is_set():
+                    break
                 # time to close and roll
                 hist = close_betting_and_roll(bot, chat_id)
                 if hist:
                     # post result with animation
                     post_roll_with_animation(chat_id, hist)
                 # small pause before opening next
-                time.sleep(1)
+                stop_event.wait(timeout=1)
             except Exception as e:
                 print("Scheduler loop error:", e, traceback.format_exc())
                 # notify admins about crash
@@ -623,7 +957,7 @@ def scheduler_loop(chat_id):
                     except:
                         pass
                 # wait a bit then continue
-                time.sleep(10)
+                stop_event.wait(timeout=10)
     except Exception as e:
         print("Scheduler outer error", e)
         for a in ADMINS:
@@ -637,18 +971,25 @@ def crash_monitor_loop(chat_id):
     try:
         while not stop_event.is_set():
             try:
-                last = data['history'][-1] if data['history'] else None
+                with users_lock.r_lock():
+                    last = data['history'][-1] if data['history'] else None
                 if last:
-                    last_ts = last['timestamp']
-                    if int(time.time()) - last_ts > (ROLL_INTERVAL*3):
+                    # rolls settled by this process are timed on the monotonic clock so wall-clock
+                    # jumps don't trigger (or hide) the warning; before the first one, use the stored timestamp
+                    if _last_roll_mono is not None:
+                        stale = time.monotonic() - _last_roll_mono > (ROLL_INTERVAL*3)
+                    else:
+                        stale = time.time() - last['timestamp'] > (ROLL_INTERVAL*3)
+                    if stale:
+                        when = datetime.fromtimestamp(last['timestamp'])
                         for a in ADMINS:
                             try:
-                                bot.send_message(chat_id=a, text=f"⚠️ Warning: Last roll was at {datetime.fromtimestamp(last_ts)}, system may be down.")
+                                bot.send_message(chat_id=a, text=f"⚠️ Warning: Last roll was at {when}, system may be down.")
                             except:
                                 pass
-                time.sleep(ROLL_INTERVAL*2)
+                stop_event.wait(timeout=ROLL_INTERVAL*2)
             except Exception as e:
-                time.sleep(5)
+                stop_event.wait(timeout=5)
     except Exception:
         pass
 
@@ -665,9 +1006,10 @@ dp.add_handler(CommandHandler('ruttien', withdraw_cmd))
 dp.add_handler(CommandHandler('setnext', admin_setnext))
 dp.add_handler(CommandHandler('setbias', admin_setbias))
 dp.add_handler(CommandHandler('credit', admin_credit))
+dp.add_handler(CommandHandler('dumpstate', admin_dumpstate))
 dp.add_handler(CallbackQueryHandler(callback_query_handler))
-# bets: handle text matching /T1000 or /X500
-dp.add_handler(MessageHandler(Filters.regex(r'^\/[TtXx]\s*[0-9]+$') & Filters.group, handle_bet_command))
+# bets: /T1000 or /X500 are parsed in handle_bet_command (prefix test first, then _BET_RE); new messages only, edits have no update.message
+dp.add_handler(MessageHandler(Filters.text & Filters.group & Filters.update.message, handle_bet_command))
 
 # start scheduler threads after bot starts polling
 def start_background(chat_id):